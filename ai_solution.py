@@ -1,19 +1,28 @@
+import json
 import os
+import re
 import time
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pandas as pd
 from dotenv import load_dotenv
 from mistralai import Mistral
 
-from constants import (ADVICE, ID_TASK_COLUMN, MISTRAL_MODEL, SOLUTION_COLUMN,
-                       TASK_COLUMN, TASK_SHEET_NAME, TASK_SLICE_LENGTH,
-                       TIME_SLEEP)
-from utils import save_to_excel
+from constants import (ADVICE, CHARS_PER_TOKEN, ID_TASK_COLUMN, MISTRAL_MODEL,
+                       PACK_ADVICE, PACK_ANSWER_TOKENS, PACK_MAX_TASKS,
+                       PACK_SHORT_TASK_TOKENS, PACK_TOKEN_BUDGET,
+                       SOLUTION_COLUMN, TASK_COLUMN, TASK_SHEET_NAME,
+                       TASK_SLICE_LENGTH, TIME_SLEEP)
+from dedup import collapse_whitespace, dedup_ratio, find_exact_duplicates
+from utils import rewrite_sheet_in_chunks, save_to_excel
 
 load_dotenv()
 MISTRAL_API_KEY: Optional[str] = os.getenv("MISTRAL_API_KEY")
 
+# Обратный слэш вместе с допустимым JSON-экранированием или одиночный обратный слэш
+_JSON_ESCAPE_RE = re.compile(r'\\(?:(["\\/]|u[0-9a-fA-F]{4}|[bfnrt](?![a-zA-Z]))|)')
+SUSPICIOUS_CONTROL_CHARS = ('\x08', '\x0c', '\t')
+
 def get_ai_solution(task_number: int, task_text: str) -> str:
     """Отправляет задачу в Mistral API и возвращает решение."""
     if not MISTRAL_API_KEY:
@@ -36,52 +45,275 @@ def get_ai_solution(task_number: int, task_text: str) -> str:
         print(f"Ошибка при запросе к API: {e}")
         return "Ошибка: не удалось получить решение"
 
-def add_ai_solution_to_excel(file_path: str) -> None:
-    """Обновляет Excel-файл, используя pandas и безопасное сохранение"""
+def estimate_tokens(text: str) -> int:
+    """Грубо оценивает количество токенов в тексте по его длине."""
+    return len(str(text)) // CHARS_PER_TOKEN + 1
+
+
+def pack_tasks(
+    tasks: List[Tuple[int, str]],
+    token_budget: int = PACK_TOKEN_BUDGET,
+    max_tasks: int = PACK_MAX_TASKS,
+) -> List[List[Tuple[int, str]]]:
+    """Группирует короткие задачи в пакеты, не превышающие бюджет токенов.
+
+    В бюджет входят условие задачи и ожидаемая длина ее решения
+    PACK_ANSWER_TOKENS, чтобы ответ на пакет не упирался в лимит вывода модели.
+    Задачи длиннее PACK_SHORT_TASK_TOKENS не упаковываются и попадают
+    в отдельный пакет. Порядок задач сохраняется.
+
+    Args:
+        tasks: Список пар (номер задачи, текст задачи)
+        token_budget: Максимальная оценка токенов условий и решений в одном пакете
+        max_tasks: Максимальное количество задач в одном пакете
+
+    Returns:
+        Список пакетов задач
+    """
+    packs: List[List[Tuple[int, str]]] = []
+    current: List[Tuple[int, str]] = []
+    current_tokens = 0
+
+    for task_number, task_text in tasks:
+        tokens = estimate_tokens(task_text)
+        if tokens > PACK_SHORT_TASK_TOKENS:
+            if current:
+                packs.append(current)
+                current, current_tokens = [], 0
+            packs.append([(task_number, task_text)])
+            continue
+
+        tokens += PACK_ANSWER_TOKENS
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_tasks):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append((task_number, task_text))
+        current_tokens += tokens
+
+    if current:
+        packs.append(current)
+    return packs
+
+
+def escape_latex_backslashes(content: str) -> str:
+    r"""Экранирует обратные слэши LaTeX, которые модель не экранировала в JSON.
+
+    Допустимые JSON-экранирования сохраняются. Исключение - \b, \f, \n, \r, \t,
+    за которыми следует латинская буква: это LaTeX-команды (\frac, \times,
+    \neq и т.п.), а не управляющие символы.
+
+    Examples:
+        >>> escape_latex_backslashes(r'"\frac{1}{2} \times 3\nОтвет"')
+        '"\\\\frac{1}{2} \\\\times 3\\nОтвет"'
+    """
+    def replace(match: re.Match) -> str:
+        return match.group(0) if match.group(1) else '\\\\'
+
+    return _JSON_ESCAPE_RE.sub(replace, content)
+
+
+def _decode_solutions(content: str, count: int) -> Optional[List[str]]:
+    """Декодирует JSON-объект с решениями или возвращает None."""
     try:
-        df: pd.DataFrame = pd.read_excel(
-            file_path, 
-            engine='openpyxl', 
-            sheet_name=TASK_SHEET_NAME
+        data = json.loads(content)
+    except ValueError:
+        return None
+
+    if not isinstance(data, dict):
+        return None
+
+    solutions: List[str] = []
+    for key in range(1, count + 1):
+        solution = data.get(str(key))
+        if not isinstance(solution, str) or not solution.strip():
+            return None
+        # Такие символы в решении означают, что LaTeX-команда была разобрана как JSON-экранирование
+        if any(char in solution for char in SUSPICIOUS_CONTROL_CHARS):
+            return None
+        solutions.append(solution)
+    return solutions
+
+
+def parse_packed_response(content: str, count: int) -> Optional[List[str]]:
+    """Разбирает JSON-ответ на пакет задач в список решений.
+
+    Сначала ответ разбирается как есть. Только если это не удалось
+    или в решениях оказались управляющие символы, неэкранированные
+    обратные слэши LaTeX экранируются и разбор повторяется.
+
+    Возвращает None, если ответ не является JSON-объектом или в нем
+    нет решения хотя бы для одной задачи пакета.
+    """
+    if not isinstance(content, str):
+        return None
+
+    content = re.sub(r'^```(?:json)?\s*|\s*```$', '', content.strip())
+    solutions = _decode_solutions(content, count)
+    if solutions is None:
+        solutions = _decode_solutions(escape_latex_backslashes(content), count)
+    return solutions
+
+
+def get_ai_solutions_packed(tasks: List[Tuple[int, str]]) -> List[str]:
+    """Отправляет пакет задач одним запросом в Mistral API.
+
+    Решения возвращаются в порядке задач пакета. Если ответ не удалось
+    разобрать, каждая задача отправляется отдельным запросом.
+    """
+    if len(tasks) == 1:
+        return [get_ai_solution(*tasks[0])]
+
+    if not MISTRAL_API_KEY:
+        return ["Ошибка: не задан API ключ"] * len(tasks)
+
+    client: Mistral = Mistral(api_key=MISTRAL_API_KEY)
+    body: str = "\n\n".join(
+        f"[{key}] Задача №{task_number}: {task_text}"
+        for key, (task_number, task_text) in enumerate(tasks, start=1)
+    )
+
+    solutions: Optional[List[str]] = None
+    try:
+        chat_response = client.chat.complete(
+            model=MISTRAL_MODEL,
+            messages=[
+                {"role": "user",
+                 "content": f"{PACK_ADVICE}\n\n{body}",
+                 },
+            ],
+            response_format={"type": "json_object"},
         )
+        solutions = parse_packed_response(chat_response.choices[0].message.content, len(tasks))
+    except Exception as e:
+        print(f"Ошибка при пакетном запросе к API: {e}")
 
-        if SOLUTION_COLUMN not in df.columns:
-            df[SOLUTION_COLUMN] = None
+    if solutions is not None:
+        return solutions
 
-        if TASK_COLUMN not in df.columns:
-            raise ValueError(f"Колонка '{TASK_COLUMN}' не найдена!")
-        
-        # Обрабатываем только строки, где есть задача и нет решения
-        mask: pd.Series = df[TASK_COLUMN].notna() & df[SOLUTION_COLUMN].isna()
-        tasks_to_process: pd.DataFrame = df[mask]
-        
-        if tasks_to_process.empty:
-            print("Нет задач для обработки.")
-            return
-        
-        print(f"Найдено {len(tasks_to_process)} задач для обработки...")
+    print("Не удалось разобрать пакетный ответ, задачи будут отправлены по одной...")
+    solutions = []
+    for task_number, task_text in tasks:
+        time.sleep(TIME_SLEEP)
+        solutions.append(get_ai_solution(task_number, task_text))
+    return solutions
 
-        with pd.ExcelFile(file_path) as excel:
-            all_sheets = {sheet: pd.read_excel(excel, sheet_name=sheet) 
-                        for sheet in excel.sheet_names}
-        
+
+def fill_ai_solutions(
+    df: pd.DataFrame,
+    pack: bool = False,
+    on_progress: Optional[Callable[[], None]] = None,
+) -> int:
+    """Заполняет колонку решений для задач без решения, изменяя df на месте.
+
+    Args:
+        df: Таблица задач с колонками TASK_COLUMN и ID_TASK_COLUMN
+        pack: Группировать короткие задачи в один запрос к API
+        on_progress: Функция, вызываемая для промежуточного сохранения
+
+    Returns:
+        Количество обработанных задач
+    """
+    if SOLUTION_COLUMN not in df.columns:
+        df[SOLUTION_COLUMN] = None
+
+    if TASK_COLUMN not in df.columns:
+        raise ValueError(f"Колонка '{TASK_COLUMN}' не найдена!")
+    
+    # Обрабатываем только строки, где есть задача и нет решения
+    mask: pd.Series = df[TASK_COLUMN].notna() & df[SOLUTION_COLUMN].isna()
+    tasks_to_process: pd.DataFrame = df[mask]
+    
+    if tasks_to_process.empty:
+        print("Нет задач для обработки.")
+        return 0
+    
+    print(f"Найдено {len(tasks_to_process)} задач для обработки...")
+
+    # Одинаковые условия решаются одним запросом. Сравнивается исходный текст:
+    # нормализация для классификатора склеивает, например, $x^2$ и $x_2$
+    representatives: List[int] = find_exact_duplicates(
+        tasks_to_process[TASK_COLUMN].tolist(), normalize=collapse_whitespace
+    )
+    duplicates: Dict[int, List[int]] = {}
+    for index, rep in zip(tasks_to_process.index, representatives):
+        duplicates.setdefault(tasks_to_process.index[rep], []).append(index)
+    processed = len(tasks_to_process)
+    tasks_to_process = tasks_to_process.loc[list(duplicates)]
+    print(f"Уникальных условий: {len(duplicates)} "
+          f"(доля дубликатов {dedup_ratio(representatives):.1%})")
+
+    if pack:
+        tasks: List[Tuple[int, str]] = list(zip(
+            tasks_to_process[ID_TASK_COLUMN], tasks_to_process[TASK_COLUMN]
+        ))
+        indices: List[int] = list(tasks_to_process.index)
+        position = 0
+        for packed in pack_tasks(tasks):
+            pack_indices = indices[position:position + len(packed)]
+            position += len(packed)
+            print(f"Обработка пакета из {len(packed)} задач: "
+                  f"{', '.join(str(number) for number, _ in packed)}...")
+
+            for index, solution in zip(pack_indices, get_ai_solutions_packed(packed)):
+                df.loc[duplicates[index], SOLUTION_COLUMN] = solution
+
+            if on_progress:
+                on_progress()
+
+            time.sleep(TIME_SLEEP)
+    else:
         for index, row in tasks_to_process.iterrows():
             task: str = row[TASK_COLUMN]
             task_number: int = row[ID_TASK_COLUMN]
             print(f"Обработка задачи: {task_number} {task[:TASK_SLICE_LENGTH]}...")
             
             solution: str = get_ai_solution(task_number, task)
-            df.at[index, SOLUTION_COLUMN] = solution
-
-            all_sheets[TASK_SHEET_NAME] = df
+            df.loc[duplicates[index], SOLUTION_COLUMN] = solution
 
-            if index % 5 == 0:
-                save_to_excel(all_sheets[TASK_SHEET_NAME], file_path, TASK_SHEET_NAME)
+            if on_progress and index % 5 == 0:
+                on_progress()
             
             time.sleep(TIME_SLEEP)
 
-        success = save_to_excel(all_sheets[TASK_SHEET_NAME], file_path, TASK_SHEET_NAME)
-        if success:
+    return processed
+
+
+def add_ai_solution_to_excel(file_path: str, pack: bool = False, chunk_size: Optional[int] = None) -> None:
+    """Обновляет Excel-файл, используя pandas и безопасное сохранение.
+
+    При pack=True короткие задачи группируются в один запрос к API
+    в пределах бюджета токенов PACK_TOKEN_BUDGET.
+
+    При заданном chunk_size лист задач читается потоково и обрабатывается
+    частями по chunk_size строк, поэтому потребление памяти не зависит
+    от размера книги. Каждая готовая часть сразу сохраняется в журнал
+    рядом с файлом, поэтому после сбоя повторный запуск продолжит работу
+    с первой необработанной части, не запрашивая готовые решения повторно.
+    """
+    try:
+        if chunk_size:
+            def process_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+                fill_ai_solutions(chunk, pack)
+                return chunk
+
+            rewrite_sheet_in_chunks(file_path, TASK_SHEET_NAME, process_chunk, chunk_size, "ai_solution")
+            print(f"Все решения записаны в файл {file_path}.")
+            return
+
+        df: pd.DataFrame = pd.read_excel(
+            file_path, 
+            engine='openpyxl', 
+            sheet_name=TASK_SHEET_NAME
+        )
+
+        processed = fill_ai_solutions(
+            df, pack, on_progress=lambda: save_to_excel(df, file_path, TASK_SHEET_NAME)
+        )
+        if not processed:
+            return
+
+        success = save_to_excel(df, file_path, TASK_SHEET_NAME)
+        if success is not None:
             print(f"Все решения записаны в файл {file_path}.")
         else:
             print("Ошибка при финальном сохранении!")
@@ -0,0 +1,318 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+import gdown
+import torch
+from dotenv import load_dotenv
+from safetensors.torch import save_file
+
+from constants import (ARTIFACTS_MANIFEST, ARTIFACTS_RETRIES,
+                       ARTIFACTS_STAMP, ARTIFACTS_WORKERS, DEST_FOLDER,
+                       GOOGLE_DRIVE_COMMON_PATH, HASH_CHUNK_SIZE,
+                       MODEL_STATE_PT, MODEL_STATE_SAFETENSORS)
+
+load_dotenv()
+ARTIFACTS_MIRROR: Optional[str] = os.getenv("ARTIFACTS_MIRROR") or None
+ARTIFACTS_MANIFEST_ID: Optional[str] = os.getenv("ARTIFACTS_MANIFEST_ID") or None
+FILE_URLS = {
+    "confidence_thresholds.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('CONFIDENCE_THRESHOLDS_JSON_ID')}",
+    MODEL_STATE_PT: f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('HIERARCHICAL_MODEL_STATE_PT_ID')}",
+    "tokenizer_config.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('TOKENIZER_CONFIG_JSON_ID')}",
+    "special_tokens_map.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('SPECIAL_TOKENS_MAP_JSON_ID')}",
+    "vocab.txt": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('VOCAB_TXT_ID')}",
+    "tokenizer.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('TOKENIZER_JSON_ID')}",
+    "label_maps.pkl": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('LABEL_MAPS_PKL_ID')}",
+    "model_architecture_config.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('MODEL_ARCHITECTURE_CONFIG_JSON_ID')}",
+    "topics.csv": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('TOPICS_CSV_ID')}",
+}
+
+
+def sha256sum(path: str) -> str:
+    """Считает SHA-256 файла, читая его блоками."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(
+    manifest_path: str = ARTIFACTS_MANIFEST,
+    mirror: Optional[str] = ARTIFACTS_MIRROR,
+) -> Dict[str, str]:
+    """Загружает манифест контрольных сумм {имя файла: sha256}.
+
+    Манифест ищется в репозитории (manifest_path), затем в каталоге-зеркале,
+    затем скачивается из Google Drive по ARTIFACTS_MANIFEST_ID.
+    Манифест никогда не строится по уже скачанным файлам.
+    """
+    if not os.path.exists(manifest_path) and mirror:
+        manifest_path = os.path.join(_mirror_dir(mirror), ARTIFACTS_MANIFEST)
+    if not os.path.exists(manifest_path) and ARTIFACTS_MANIFEST_ID:
+        manifest_path = os.path.join(DEST_FOLDER, ARTIFACTS_MANIFEST)
+        gdown.download(f"{GOOGLE_DRIVE_COMMON_PATH}={ARTIFACTS_MANIFEST_ID}", manifest_path, quiet=True)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def is_valid(path: str, expected_sha256: str) -> bool:
+    """Проверяет, что файл существует и совпадает с контрольной суммой из манифеста."""
+    return os.path.isfile(path) and sha256sum(path) == expected_sha256
+
+
+def _file_version(path: str) -> List[int]:
+    """Возвращает [размер, mtime_ns] файла для сравнения со штампом проверки."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_stamp(dest_folder: str = DEST_FOLDER) -> Dict[str, dict]:
+    """Загружает штамп проверенных файлов {имя: {version, sha256}}."""
+    stamp_path = os.path.join(dest_folder, ARTIFACTS_STAMP)
+    if not os.path.exists(stamp_path):
+        return {}
+    try:
+        with open(stamp_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def write_stamp(manifest: Dict[str, str], dest_folder: str = DEST_FOLDER) -> None:
+    """Запоминает размер и mtime файлов, прошедших проверку по манифесту."""
+    stamp = {
+        name: {"version": _file_version(os.path.join(dest_folder, name)), "sha256": manifest[name]}
+        for name in FILE_URLS
+    }
+    with open(os.path.join(dest_folder, ARTIFACTS_STAMP), 'w', encoding='utf-8') as f:
+        json.dump(stamp, f, indent=2)
+
+
+def is_stamped(name: str, stamp: Dict[str, dict], expected_sha256: Optional[str] = None,
+               dest_folder: str = DEST_FOLDER) -> bool:
+    """Проверяет по штампу, что файл не менялся после проверки контрольной суммы."""
+    path = os.path.join(dest_folder, name)
+    entry = stamp.get(name)
+    if not entry or not os.path.isfile(path) or entry.get("version") != _file_version(path):
+        return False
+    return expected_sha256 is None or entry.get("sha256") == expected_sha256
+
+
+def _mirror_dir(mirror: str) -> str:
+    """Возвращает путь к каталогу-зеркалу, принимая как путь, так и file:// URL."""
+    if mirror.startswith('file://'):
+        return unquote(urlparse(mirror).path)
+    return mirror
+
+
+def _copy_with_resume(source: str, output_path: str) -> None:
+    """Копирует файл из зеркала, продолжая с места обрыва предыдущей попытки."""
+    part_path = f"{output_path}.part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset > os.path.getsize(source):
+        offset = 0
+        os.remove(part_path)
+    with open(source, 'rb') as src, open(part_path, 'ab') as dst:
+        src.seek(offset)
+        shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+    os.replace(part_path, output_path)
+
+
+def fetch_artifact(
+    name: str,
+    url: str,
+    expected_sha256: str,
+    mirror: Optional[str] = None,
+    dest_folder: str = DEST_FOLDER,
+) -> bool:
+    """Скачивает один файл модели и проверяет его контрольную сумму.
+
+    Уже скачанный файл с верной контрольной суммой не скачивается повторно.
+    Файл с неверной контрольной суммой удаляется и скачивается заново.
+    Прерванная загрузка продолжается с места обрыва.
+
+    Args:
+        name: Имя файла в каталоге артефактов
+        url: Ссылка на файл в Google Drive
+        expected_sha256: Ожидаемая контрольная сумма из манифеста
+        mirror: Локальный каталог или file:// URL с копиями файлов
+        dest_folder: Каталог для сохранения файлов
+
+    Returns:
+        True, если файл на месте и прошел проверку
+    """
+    output_path = os.path.join(dest_folder, name)
+    if is_stamped(name, load_stamp(dest_folder), expected_sha256, dest_folder) or is_valid(output_path, expected_sha256):
+        print(f"Файл {name} уже существует, пропускаем")
+        return True
+
+    for attempt in range(1, ARTIFACTS_RETRIES + 1):
+        if os.path.exists(output_path):
+            print(f"Файл {name} поврежден, скачиваем заново...")
+            os.remove(output_path)
+        try:
+            if mirror:
+                _copy_with_resume(os.path.join(_mirror_dir(mirror), name), output_path)
+            else:
+                gdown.download(url, output_path, quiet=True, resume=True)
+        except Exception as e:
+            print(f"Ошибка при скачивании {name} (попытка {attempt}): {e}")
+            continue
+
+        if is_valid(output_path, expected_sha256):
+            print(f"Файл {name} скачан")
+            return True
+
+    print(f"Ошибка: не удалось получить корректный файл {name}")
+    return False
+
+
+def download_files(
+    mirror: Optional[str] = ARTIFACTS_MIRROR,
+    workers: int = ARTIFACTS_WORKERS,
+    manifest_path: str = ARTIFACTS_MANIFEST,
+) -> None:
+    """Параллельно скачивает необходимые файлы и проверяет их по манифесту.
+
+    Используется командой `python artifacts.py prefetch`. Без манифеста
+    с контрольными суммами всех файлов завершается ошибкой. Проверенные
+    файлы записываются в штамп, который затем читает check_artifacts.
+    """
+    print("Скачивание файлов модели...")
+    os.makedirs(DEST_FOLDER, exist_ok=True)
+    manifest = load_manifest(manifest_path, mirror)
+    unverifiable: List[str] = [name for name in FILE_URLS if name not in manifest]
+    if unverifiable:
+        raise RuntimeError(
+            f"Нет контрольных сумм для файлов модели: {', '.join(unverifiable)}. "
+            f"Добавьте их в {ARTIFACTS_MANIFEST} (в репозитории, в зеркале или по ARTIFACTS_MANIFEST_ID)"
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(FILE_URLS, executor.map(
+            lambda item: fetch_artifact(item[0], item[1], manifest[item[0]], mirror),
+            FILE_URLS.items(),
+        )))
+
+    failed: List[str] = [name for name, ok in results.items() if not ok]
+    if failed:
+        raise RuntimeError(f"Не удалось скачать файлы модели: {', '.join(failed)}")
+
+    write_stamp(manifest)
+    ensure_safetensors_state()
+
+
+def check_artifacts(dest_folder: str = DEST_FOLDER) -> None:
+    """Быстрая проверка файлов модели при импорте классификатора.
+
+    Контрольные суммы не пересчитываются: файл считается проверенным,
+    если его размер и mtime совпадают со штампом, записанным командой
+    `python artifacts.py prefetch`. Файл, изменившийся после проверки,
+    считается поврежденным. Отсутствующие файлы скачиваются без проверки,
+    а непроверенные файлы только отмечаются в выводе.
+    """
+    os.makedirs(dest_folder, exist_ok=True)
+    stamp = load_stamp(dest_folder)
+    unverified: List[str] = []
+    for name, url in FILE_URLS.items():
+        path = os.path.join(dest_folder, name)
+        if is_stamped(name, stamp, dest_folder=dest_folder):
+            continue
+        if name in stamp and os.path.isfile(path):
+            raise RuntimeError(
+                f"Файл {name} изменился после проверки. Запустите 'python artifacts.py prefetch'"
+            )
+        if not os.path.isfile(path):
+            print(f"Скачивание {name}...")
+            gdown.download(url, path, quiet=False, resume=True)
+        unverified.append(name)
+
+    if unverified:
+        print(f"Файлы модели не проверены по контрольным суммам: {', '.join(unverified)}. "
+              f"Для проверки запустите 'python artifacts.py prefetch'")
+    ensure_safetensors_state(dest_folder)
+
+
+def convert_state_to_safetensors(pt_path: str, safetensors_path: str) -> None:
+    """Конвертирует state_dict модели из pickle-файла .pt в формат safetensors.
+
+    Тензоры с общим хранилищем копируются, так как safetensors
+    не допускает разделяемую память между тензорами.
+    """
+    state = torch.load(pt_path, map_location="cpu", mmap=True, weights_only=True)
+    seen_storages = set()
+    tensors: Dict[str, torch.Tensor] = {}
+    for key, tensor in state.items():
+        storage_ptr = tensor.untyped_storage().data_ptr()
+        tensors[key] = tensor.clone() if storage_ptr in seen_storages else tensor.contiguous()
+        seen_storages.add(storage_ptr)
+
+    part_path = f"{safetensors_path}.part"
+    save_file(tensors, part_path)
+    os.replace(part_path, safetensors_path)
+
+
+def ensure_safetensors_state(dest_folder: str = DEST_FOLDER) -> None:
+    """Создает safetensors-версию весов модели, если ее нет или она устарела."""
+    pt_path = os.path.join(dest_folder, MODEL_STATE_PT)
+    safetensors_path = os.path.join(dest_folder, MODEL_STATE_SAFETENSORS)
+    if not os.path.isfile(pt_path):
+        return
+    if (os.path.isfile(safetensors_path)
+            and os.path.getmtime(safetensors_path) >= os.path.getmtime(pt_path)):
+        return
+
+    print(f"Конвертация {MODEL_STATE_PT} в {MODEL_STATE_SAFETENSORS}...")
+    convert_state_to_safetensors(pt_path, safetensors_path)
+
+
+def write_manifest(source_dir: str, manifest_path: str = ARTIFACTS_MANIFEST) -> None:
+    """Записывает манифест контрольных сумм по эталонному набору файлов модели.
+
+    source_dir должен содержать проверенные исходные файлы (например, каталог,
+    из которого они публикуются), а не рабочий каталог артефактов: манифест
+    по поврежденной копии признал бы ее корректной.
+    """
+    missing: List[str] = [name for name in FILE_URLS if not os.path.isfile(os.path.join(source_dir, name))]
+    if missing:
+        raise RuntimeError(f"В каталоге {source_dir} нет файлов: {', '.join(missing)}")
+
+    manifest = {name: sha256sum(os.path.join(source_dir, name)) for name in FILE_URLS}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"Манифест записан в {manifest_path} ({len(manifest)} файлов)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Управление файлами модели классификатора")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prefetch_parser = subparsers.add_parser("prefetch", help="Скачать и проверить все файлы модели")
+    prefetch_parser.add_argument("--mirror", default=ARTIFACTS_MIRROR,
+                                 help="Локальный каталог или file:// URL с копиями файлов")
+    prefetch_parser.add_argument("--workers", type=int, default=ARTIFACTS_WORKERS)
+
+    manifest_parser = subparsers.add_parser("manifest", help="Записать манифест по эталонным файлам модели")
+    manifest_parser.add_argument("--from", dest="source_dir", required=True,
+                                 help="Каталог с проверенными исходными файлами модели")
+    manifest_parser.add_argument("--output", default=ARTIFACTS_MANIFEST)
+    subparsers.add_parser("convert", help=f"Сконвертировать {MODEL_STATE_PT} в {MODEL_STATE_SAFETENSORS}")
+
+    args = parser.parse_args()
+    if args.command == "prefetch":
+        download_files(mirror=args.mirror, workers=args.workers)
+    elif args.command == "manifest":
+        write_manifest(args.source_dir, args.output)
+    elif args.command == "convert":
+        convert_state_to_safetensors(
+            os.path.join(DEST_FOLDER, MODEL_STATE_PT),
+            os.path.join(DEST_FOLDER, MODEL_STATE_SAFETENSORS),
+        )
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime
+from itertools import product
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import torch
+
+from constants import (AUTOTUNE_BATCH_SIZES, AUTOTUNE_FILE,
+                       AUTOTUNE_MAX_LENGTHS, AUTOTUNE_MAX_TRUNCATED_SHARE,
+                       AUTOTUNE_SAMPLE_SIZE, AUTOTUNE_WARMUP_BATCHES,
+                       DEST_FOLDER, TASK_COLUMN, TASK_SHEET_NAME)
+
+AUTOTUNE_PATH = os.path.join(DEST_FOLDER, AUTOTUNE_FILE)
+
+
+def host_fingerprint() -> str:
+    """Возвращает идентификатор хоста: имя, архитектура, число ядер и устройство."""
+    device = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "cpu"
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count()}cpu|{device}|torch-{torch.__version__}"
+
+
+def load_inference_config(path: str = AUTOTUNE_PATH) -> Dict[str, Any]:
+    """Загружает сохраненную конфигурацию инференса для текущего хоста.
+
+    Returns:
+        Словарь с ключами batch_size, num_threads, num_interop_threads,
+        max_length или пустой словарь, если хост еще не настраивался
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get(host_fingerprint(), {})
+
+
+def save_inference_config(config: Dict[str, Any], path: str = AUTOTUNE_PATH) -> None:
+    """Сохраняет конфигурацию инференса для текущего хоста, не затрагивая другие хосты."""
+    configs: Dict[str, Dict[str, Any]] = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            configs = json.load(f)
+    configs[host_fingerprint()] = config
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(configs, f, indent=2, ensure_ascii=False)
+
+
+def apply_inference_config(config: Dict[str, Any]) -> None:
+    """Применяет настройки потоков torch из конфигурации."""
+    if config.get("num_threads"):
+        torch.set_num_threads(config["num_threads"])
+    if config.get("num_interop_threads"):
+        try:
+            torch.set_num_interop_threads(config["num_interop_threads"])
+        except RuntimeError:
+            # Число inter-op потоков можно задать только до начала параллельной работы
+            pass
+
+
+def thread_candidates(cpu_count: Optional[int] = None) -> List[int]:
+    """Возвращает варианты числа потоков: 1/4, 1/2 и все ядра хоста.
+
+    Examples:
+        >>> thread_candidates(8)
+        [2, 4, 8]
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return sorted({max(1, cpu_count // 4), max(1, cpu_count // 2), cpu_count})
+
+
+def length_candidates(token_lengths: List[int], max_length_limit: int) -> List[int]:
+    """Возвращает ограничения длины, при которых обрезается не больше
+    AUTOTUNE_MAX_TRUNCATED_SHARE задач выборки.
+
+    Ограничение модели max_length_limit всегда входит в результат.
+    """
+    candidates = {max_length_limit}
+    for max_length in AUTOTUNE_MAX_LENGTHS:
+        if max_length >= max_length_limit:
+            continue
+        truncated = sum(length > max_length for length in token_lengths)
+        if token_lengths and truncated / len(token_lengths) <= AUTOTUNE_MAX_TRUNCATED_SHARE:
+            candidates.add(max_length)
+    return sorted(candidates)
+
+
+def measure_throughput(
+    predict: Callable[..., Any],
+    texts: List[str],
+    batch_size: int,
+    max_length: int,
+) -> float:
+    """Измеряет скорость классификации в задачах в секунду.
+
+    Перед замером выполняется прогрев на AUTOTUNE_WARMUP_BATCHES батчах.
+    """
+    for i in range(0, min(len(texts), batch_size * AUTOTUNE_WARMUP_BATCHES), batch_size):
+        predict(texts[i:i + batch_size], max_length=max_length)
+
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        predict(texts[i:i + batch_size], max_length=max_length)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def autotune(
+    predict: Callable[..., Any],
+    texts: List[str],
+    token_lengths: List[int],
+    max_length_limit: int,
+) -> Dict[str, Any]:
+    """Перебирает размеры батча, число потоков и ограничения длины,
+    сохраняет лучшую по числу задач в секунду конфигурацию для хоста.
+
+    Args:
+        predict: Функция классификации, принимающая список текстов и max_length
+        texts: Выборка реальных задач
+        token_lengths: Длины задач выборки в токенах
+        max_length_limit: Ограничение длины, с которым обучалась модель
+
+    Returns:
+        Лучшая конфигурация
+    """
+    best: Dict[str, Any] = {}
+    grid = product(AUTOTUNE_BATCH_SIZES, thread_candidates(), length_candidates(token_lengths, max_length_limit))
+    for batch_size, num_threads, max_length in grid:
+        torch.set_num_threads(num_threads)
+        tasks_per_sec = measure_throughput(predict, texts, batch_size, max_length)
+        print(f"batch_size={batch_size} num_threads={num_threads} "
+              f"max_length={max_length}: {tasks_per_sec:.1f} задач/с")
+        if tasks_per_sec > best.get("tasks_per_sec", 0):
+            best = {
+                "batch_size": batch_size,
+                "num_threads": num_threads,
+                # Одна модель выполняется одним потоком вызовов, inter-op параллелизм не нужен
+                "num_interop_threads": 1,
+                "max_length": max_length,
+                "tasks_per_sec": round(tasks_per_sec, 2),
+                "tuned_at": datetime.now().isoformat(timespec="seconds"),
+            }
+
+    save_inference_config(best)
+    print(f"Лучшая конфигурация для {host_fingerprint()}: {best}")
+    return best
+
+
+def load_sample(output_file: str, sample_size: int = AUTOTUNE_SAMPLE_SIZE) -> List[str]:
+    """Выбирает случайные задачи из листа <TASK_SHEET_NAME> для замеров."""
+    tasks = pd.read_excel(output_file, sheet_name=TASK_SHEET_NAME)[TASK_COLUMN].dropna()
+    return tasks.sample(n=min(sample_size, len(tasks)), random_state=0).astype(str).tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Подбор параметров инференса классификатора для хоста")
+    parser.add_argument("output_file", help="Excel-файл с задачами для замеров")
+    parser.add_argument("--sample", type=int, default=AUTOTUNE_SAMPLE_SIZE)
+    args = parser.parse_args()
+
+    import classifier
+
+    sample = load_sample(args.output_file, args.sample)
+    lengths = [len(ids) for ids in classifier.tokenizer(
+        [classifier.preprocess_latex_for_model(text) for text in sample]
+    )["input_ids"]]
+    autotune(classifier.predict_texts_hierarchical, sample, lengths, classifier.TOKENIZER_MAX_LENGTH)
@@ -1,50 +1,27 @@
 import json
 import os
 import pickle
-import re
 import warnings
-from typing import Dict, List
+from contextlib import contextmanager
+from typing import Dict, List, Optional
 
-import gdown
 import numpy as np
 import pandas as pd
 import torch
-from dotenv import load_dotenv
-from transformers import AutoModel, AutoTokenizer
+from safetensors.torch import load_file
+from transformers import AutoConfig, AutoModel, AutoTokenizer
 
-from constants import (BATCH_SIZE, DEST_FOLDER, GOOGLE_DRIVE_COMMON_PATH,
-                       TASK_COLUMN, TASK_SHEET_NAME)
+from artifacts import check_artifacts
+from autotune import apply_inference_config, load_inference_config
+from constants import (BATCH_SIZE, DEST_FOLDER, MODEL_STATE_PT,
+                       MODEL_STATE_SAFETENSORS, TASK_COLUMN, TASK_SHEET_NAME)
 from decorators import validate_excel_file
+from dedup import cluster_near_duplicates, dedup_ratio
+from utils import preprocess_latex_for_model, rewrite_sheet_in_chunks
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-os.makedirs(DEST_FOLDER, exist_ok=True)
-load_dotenv()
-FOLDER_ID_ARTIFACTS = os.getenv("FOLDER_ID_ARTIFACTS")
-FILE_URLS = {
-    "confidence_thresholds.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('CONFIDENCE_THRESHOLDS_JSON_ID')}",
-    "hierarchical_model_state.pt": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('HIERARCHICAL_MODEL_STATE_PT_ID')}",
-    "tokenizer_config.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('TOKENIZER_CONFIG_JSON_ID')}",
-    "special_tokens_map.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('SPECIAL_TOKENS_MAP_JSON_ID')}",
-    "vocab.txt": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('VOCAB_TXT_ID')}",
-    "tokenizer.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('TOKENIZER_JSON_ID')}",
-    "label_maps.pkl": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('LABEL_MAPS_PKL_ID')}",
-    "model_architecture_config.json": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('MODEL_ARCHITECTURE_CONFIG_JSON_ID')}",
-    "topics.csv": f"{GOOGLE_DRIVE_COMMON_PATH}={os.getenv('TOPICS_CSV_ID')}",
-}
-
-def download_files():
-    """Скачивает необходимые файлы"""
-    print("Скачивание файлов модели...")
-    for name, url in FILE_URLS.items():
-        output_path = os.path.join(DEST_FOLDER, name)
-        if not os.path.exists(output_path):
-            print(f"Скачивание {name}...")
-            gdown.download(url, output_path, quiet=False)
-        else:
-            print(f"Файл {name} уже существует, пропускаем")
-
-download_files()
+check_artifacts()
 
 ART_PATH = lambda fn: os.path.join(DEST_FOLDER, fn)
 
@@ -61,10 +38,44 @@ MAX_LEVELS_CONFIG = cfg.get("max_levels_defined_in_script", 3)
 print("Инициализация модели...")
 tokenizer = AutoTokenizer.from_pretrained(DEST_FOLDER)
 
+@contextmanager
+def init_empty_weights():
+    """Создает параметры модели на устройстве meta, не выделяя под них память.
+
+    Буферы остаются на CPU, поэтому непостоянные буферы энкодера
+    (например, position_ids) сохраняют свои значения.
+    """
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            module._parameters[name] = torch.nn.Parameter(
+                module._parameters[name].to("meta"), requires_grad=param.requires_grad
+            )
+
+    torch.nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def load_model_state() -> Dict[str, torch.Tensor]:
+    """Загружает веса модели, отображая файл в память (mmap).
+
+    Предпочитается safetensors-файл; если его нет, используется .pt.
+    """
+    if os.path.isfile(ART_PATH(MODEL_STATE_SAFETENSORS)):
+        return load_file(ART_PATH(MODEL_STATE_SAFETENSORS), device="cpu")
+    return torch.load(ART_PATH(MODEL_STATE_PT), map_location="cpu", mmap=True, weights_only=True)
+
+
 class HierarchicalClassifier(torch.nn.Module):
     def __init__(self, base_model_name: str, num_classes_list: List[int]) -> None:
         super().__init__()
-        self.encoder = AutoModel.from_pretrained(base_model_name)
+        # Веса энкодера загружаются из состояния модели, поэтому предобученные веса не нужны
+        self.encoder = AutoModel.from_config(AutoConfig.from_pretrained(base_model_name))
         self.classifiers = torch.nn.ModuleList()
         for n_classes in num_classes_list:
             if n_classes > 0:
@@ -78,8 +89,9 @@ class HierarchicalClassifier(torch.nn.Module):
         pooled = self.encoder(input_ids=input_ids, attention_mask=attention_mask).pooler_output
         return [clf(pooled) for clf in self.classifiers if clf is not None]
 
-model = HierarchicalClassifier(MODEL_NAME_HF, num_classes_per_level)
-model.load_state_dict(torch.load(ART_PATH("hierarchical_model_state.pt"), map_location="cpu"))
+with init_empty_weights():
+    model = HierarchicalClassifier(MODEL_NAME_HF, num_classes_per_level)
+model.load_state_dict(load_model_state(), assign=True)
 model.eval()
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model.to(DEVICE)
@@ -95,31 +107,6 @@ TOPICS_DF = pd.read_csv(ART_PATH("topics.csv"))
 ID2NAME = TOPICS_DF.set_index("id")["name"].to_dict()
 
 # Функции предобработки и предсказания
-def preprocess_latex_for_model(text: str) -> str:
-    if not isinstance(text, str):
-        return ""
-
-    def process_formula(match):
-        formula = match.group(1)
-        substitutions = {
-            r"\\frac": ' / ', r"\\cdot": ' · ', r"\\times": ' × ',
-            r"\\div": ' ÷ ', r"\\leq": ' ≤ ', r"\\geq": ' ≥ ',
-            r"\\neq": ' ≠ ', r"\\approx": ' ≈ ', r"\\rightarrow": ' → ',
-            r"\\leftarrow": ' ← ', r"\\leftrightarrow": ' ↔ ',
-            r"\\partial": ' ∂ ', r"\\infty": ' ∞ ', r"\\pi": ' π ',
-            r"\\int": ' <INT> ', r"\\sum": ' <SUM> ', r"\\lim": ' <LIM> ',
-            r"\\sqrt": ' <SQRT> ', r"[{}^_\\]": ' ', r"\s+": ' '
-        }
-        for pattern, replacement in substitutions.items():
-            formula = re.sub(pattern, replacement, formula)
-        return f" {formula.strip()} "
-
-    processed_text = text
-    patterns = [r"\\\((.*?)\\\)", r"\\\[(.*?)\\\]", r"\$(.*?)\$"]
-    for pat in patterns:
-        processed_text = re.sub(pat, process_formula, processed_text)
-    return re.sub(r"\s+", ' ', processed_text).strip().lower()
-
 def decode_prediction(pred_idx: int, pred_prob: float, original_level_idx: int) -> Dict:
     threshold = conf_thresholds.get(original_level_idx, 0.05)
     if pred_prob >= threshold and pred_idx != IGNORE_INDEX:
@@ -139,7 +126,7 @@ def decode_prediction(pred_idx: int, pred_prob: float, original_level_idx: int)
     return {"id": None, "name": "—"}
 
 @torch.inference_mode()
-def predict_texts_hierarchical(texts: List[str]) -> List[List[Dict]]:
+def predict_texts_hierarchical(texts: List[str], max_length: Optional[int] = None) -> List[List[Dict]]:
     if not texts:
         return []
 
@@ -148,7 +135,7 @@ def predict_texts_hierarchical(texts: List[str]) -> List[List[Dict]]:
         processed,
         padding=True,
         truncation=True,
-        max_length=TOKENIZER_MAX_LENGTH,
+        max_length=max_length or TOKENIZER_MAX_LENGTH,
         return_tensors="pt"
     ).to(DEVICE)
     
@@ -166,36 +153,89 @@ def predict_texts_hierarchical(texts: List[str]) -> List[List[Dict]]:
     return results
 
 
+def classify_dataframe(
+    df: pd.DataFrame,
+    dedup: bool = True,
+    batch_size: int = BATCH_SIZE,
+    max_length: Optional[int] = None,
+) -> pd.DataFrame:
+    """Добавляет в таблицу задач колонки с темами всех уровней.
+
+    При dedup=True почти одинаковые задачи объединяются в кластеры,
+    модель получает только по одному представителю кластера,
+    а его темы переносятся на остальные задачи кластера.
+    """
+    if TASK_COLUMN not in df.columns:
+        print(f"Колонка '{TASK_COLUMN}' не найдена. Доступные колонки: {list(df.columns)}")
+
+    texts = df[TASK_COLUMN].fillna("").tolist()
+    if dedup:
+        representatives = cluster_near_duplicates(texts)
+        print(f"Дедупликация: {len(set(representatives))} уникальных из {len(texts)} "
+              f"(доля дубликатов {dedup_ratio(representatives):.1%})")
+    else:
+        representatives = list(range(len(texts)))
+    unique_indices = sorted(set(representatives))
+
+    print(f"\nОбработка {len(unique_indices)} задач...")
+    unique_preds = {}
+    
+    for i in range(0, len(unique_indices), batch_size):
+        batch_indices = unique_indices[i:i+batch_size]
+        batch = [texts[idx] for idx in batch_indices]
+        unique_preds.update(zip(batch_indices, predict_texts_hierarchical(batch, max_length)))
+        print(f"Обработано: {min(i+batch_size, len(unique_indices))}/{len(unique_indices)}")
+
+    all_preds = [unique_preds[rep] for rep in representatives]
+    
+    # Добавление результатов в DataFrame
+    for lvl in range(MAX_LEVELS_CONFIG):
+        df[f'topic_id_lvl_{lvl+1}'] = [p[lvl]['id'] for p in all_preds]
+        df[f'topic_name_{lvl+1}'] = [p[lvl]['name'] for p in all_preds]
+    return df
+
+
 @validate_excel_file
-def process_topics(output_file: str):
+def process_topics(output_file: str, dedup: bool = True, chunk_size: Optional[int] = None):
+    """Классифицирует задачи листа <TASK_SHEET_NAME> по темам.
+
+    При заданном chunk_size лист читается потоково и классифицируется
+    частями по chunk_size строк, поэтому потребление памяти ограничено
+    размером части, а не размером книги. Дедупликация в этом режиме
+    выполняется в пределах одной части.
+
+    Размер батча, число потоков и ограничение длины берутся из конфигурации,
+    подобранной для хоста командой `python autotune.py`, если она есть.
+    """
     print("\nИерархическая классификация математических задач...")
     try:
-        with pd.ExcelFile(output_file) as xls:
-            if TASK_SHEET_NAME not in xls.sheet_names:
-                print(f"Лист '{TASK_SHEET_NAME}' не найден в файле!")
-                
-            df = pd.read_excel(xls, sheet_name=TASK_SHEET_NAME)
-            
-        if TASK_COLUMN not in df.columns:
-            print(f"Колонка '{TASK_COLUMN}' не найдена. Доступные колонки: {list(df.columns)}")
+        config = load_inference_config()
+        if config:
+            print(f"Используется конфигурация инференса для хоста: {config}")
+            apply_inference_config(config)
+        batch_size = config.get("batch_size", BATCH_SIZE)
+        max_length = config.get("max_length")
+
+        if chunk_size:
+            rewrite_sheet_in_chunks(
+                output_file,
+                TASK_SHEET_NAME,
+                lambda chunk: classify_dataframe(chunk, dedup, batch_size, max_length),
+                chunk_size,
+                "topics",
+            )
+        else:
+            with pd.ExcelFile(output_file) as xls:
+                if TASK_SHEET_NAME not in xls.sheet_names:
+                    print(f"Лист '{TASK_SHEET_NAME}' не найден в файле!")
+                    
+                df = pd.read_excel(xls, sheet_name=TASK_SHEET_NAME)
+
+            df = classify_dataframe(df, dedup, batch_size, max_length)
             
-        # Предсказание
-        print(f"\nОбработка {len(df)} задач...")
-        all_preds = []
-        
-        for i in range(0, len(df), BATCH_SIZE):
-            batch = df[TASK_COLUMN].iloc[i:i+BATCH_SIZE].fillna("").tolist()
-            all_preds.extend(predict_texts_hierarchical(batch))
-            print(f"Обработано: {min(i+BATCH_SIZE, len(df))}/{len(df)}")
-        
-        # Добавление результатов в DataFrame
-        for lvl in range(MAX_LEVELS_CONFIG):
-            df[f'topic_id_lvl_{lvl+1}'] = [p[lvl]['id'] for p in all_preds]
-            df[f'topic_name_{lvl+1}'] = [p[lvl]['name'] for p in all_preds]
-        
-        # Сохранение обратно в тот же файл
-        with pd.ExcelWriter(output_file, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            df.to_excel(writer, sheet_name=TASK_SHEET_NAME, index=False)
+            # Сохранение обратно в тот же файл
+            with pd.ExcelWriter(output_file, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+                df.to_excel(writer, sheet_name=TASK_SHEET_NAME, index=False)
         
         print(f"\nРезультаты добавлены в файл: {output_file} (лист '{TASK_SHEET_NAME}')")
         print("Завершение работы...")
@@ -2,9 +2,21 @@ ADVICE = "Реши задачу по математике."
 "Ответ должен быть полным и пошаговым."
 "Если текст задачи, несмотря на контекст непонятен, то таком случае верни текст 'Некорректное условие задачи'"
 ANSWER_COLUMN = "answer"
+ARTIFACTS_MANIFEST = "artefacts_manifest.json"
+ARTIFACTS_RETRIES = 3
+ARTIFACTS_STAMP = ".verified_artifacts.json"
+ARTIFACTS_WORKERS = 4
 AUTHOR = ' А. В. Шевкин.'
 AUTHOR_SHEET_NAME = "author"
+AUTOTUNE_BATCH_SIZES = [8, 16, 32, 64, 128]
+AUTOTUNE_FILE = "autotune.json"
+AUTOTUNE_MAX_LENGTHS = [64, 96, 128, 256]
+AUTOTUNE_MAX_TRUNCATED_SHARE = 0.01
+AUTOTUNE_SAMPLE_SIZE = 512
+AUTOTUNE_WARMUP_BATCHES = 2
 BATCH_SIZE = 32
+CHARS_PER_TOKEN = 3
+CHUNK_JOURNAL_SUFFIX = ".partial.jsonl"
 CLASSES = '5;6'
 CLASSES_COLUMN = "classes"
 DESCRIPTION = 'Сборник включает текстовые задачи по разделам школьной математики: натуральные числа, дроби, пропорции, проценты, уравнения. ' \
@@ -13,13 +25,29 @@ DESCRIPTION = 'Сборник включает текстовые задачи 
 'Материалы сборника можно использовать как дополнение к любому действующему учебнику. '
 'При подготовке этого издания добавлены новые задачи и решения некоторых задач. '
 'Пособие предназначено для учащихся 5–6 классов общеобразовательных школ, учителей, студентов педагогических вузов. '
+DEDUP_BANDS = 16
+DEDUP_NUM_PERM = 128
+DEDUP_SEED = 42
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_THRESHOLD = 0.85
 DEST_FOLDER = "./artefacts_pytorch"
 DOCX_PATH = "tekstovye_zadachi_po_matematike_1.docx"
 GOOGLE_DRIVE_COMMON_PATH = "https://drive.google.com/uc?id"
+HASH_CHUNK_SIZE = 1 << 20
 ID_TASK_COLUMN = "id_tasks_book"
 MISTRAL_MODEL = "mistral-large-latest"
+MODEL_STATE_PT = "hierarchical_model_state.pt"
+MODEL_STATE_SAFETENSORS = "hierarchical_model_state.safetensors"
 NAME = 'Текстовые задачи по математике. 5–6 классы / А. В. Шевкин. — 3-е изд., перераб. — М. : Илекса, 2024. — 160 с. : ил.'
 OUTPUT_FILE="tasks.xlsx"
+PACK_ADVICE = ("Ниже несколько независимых задач, каждая помечена ключом в квадратных скобках. "
+               "Реши каждую задачу полностью и пошагово. "
+               "Верни только JSON-объект, где ключ - метка задачи без скобок, а значение - решение задачи строкой. "
+               "Если условие задачи непонятно, то в качестве решения верни текст 'Некорректное условие задачи'.")
+PACK_ANSWER_TOKENS = 400
+PACK_MAX_TASKS = 8
+PACK_SHORT_TASK_TOKENS = 150
+PACK_TOKEN_BUDGET = 4000
 PARAGRAPH_COLUMN = "paragraph"
 SOLUTION_COLUMN = "AI_solution"
 TASK_COLUMN = "task"
@@ -29,6 +57,7 @@ TIME_SLEEP = 3
 TOC_SHEET_NAME = "table_of_contents"
 TOPIC_ID = 1
 TRIM_CHARS = 5
+VALIDATION_CACHE_SIZE = 128
 AUTHOR_DATA = [
         {'name': NAME,
         'author': AUTHOR,
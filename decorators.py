@@ -1,8 +1,62 @@
 import os
-from functools import wraps
+import zipfile
+from functools import lru_cache, wraps
+from typing import Optional
 
-import pandas as pd
-from docx import Document
+from constants import VALIDATION_CACHE_SIZE
+
+CONTENT_TYPES_PART = '[Content_Types].xml'
+DOCX_MAIN_PART = 'word/document.xml'
+XLSX_MAIN_PART = 'xl/workbook.xml'
+XLSX_SHEETS_PREFIX = 'xl/worksheets/'
+XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def _check_package(path: str, size: int, mtime_ns: int, main_part: str) -> Optional[str]:
+    """Проверяет структуру OOXML-пакета без разбора его содержимого.
+
+    Читается только центральный каталог zip-архива. Размер и время
+    изменения файла входят в ключ кэша, поэтому после перезаписи
+    файла проверка выполняется заново.
+
+    Returns:
+        None, если файл корректен, иначе описание ошибки
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+    except (zipfile.BadZipFile, OSError) as e:
+        return str(e)
+
+    if CONTENT_TYPES_PART not in names:
+        return f"отсутствует {CONTENT_TYPES_PART}"
+    if main_part not in names:
+        return f"отсутствует {main_part}"
+    if main_part == XLSX_MAIN_PART and not any(name.startswith(XLSX_SHEETS_PREFIX) for name in names):
+        return "файл не содержит листов"
+    return None
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def _check_xls(path: str, size: int, mtime_ns: int) -> Optional[str]:
+    """Проверяет сигнатуру OLE2-контейнера старого формата XLS."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(len(XLS_SIGNATURE))
+    except OSError as e:
+        return str(e)
+    return None if header == XLS_SIGNATURE else "неверная сигнатура файла XLS"
+
+
+def check_file_structure(path: str) -> Optional[str]:
+    """Проверяет структуру DOCX/XLSX/XLS файла с кэшированием по (путь, размер, mtime)."""
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    if path.lower().endswith('.xls'):
+        return _check_xls(path, stat.st_size, stat.st_mtime_ns)
+    main_part = DOCX_MAIN_PART if path.lower().endswith('.docx') else XLSX_MAIN_PART
+    return _check_package(path, stat.st_size, stat.st_mtime_ns, main_part)
 
 
 def validate_docx_file(func):
@@ -12,11 +66,10 @@ def validate_docx_file(func):
         if not (os.path.isfile(input_file) and input_file.lower().endswith('.docx')):
             print(f"Ошибка: Файл {input_file} не является DOCX или не существует")
             return None
-        
-        try:
-            Document(input_file)
-        except Exception as e:
-            print(f"Ошибка: Файл {input_file} поврежден или не является DOCX: {str(e)}")
+
+        error = check_file_structure(input_file)
+        if error:
+            print(f"Ошибка: Файл {input_file} поврежден или не является DOCX: {error}")
             return None
 
         try:
@@ -24,7 +77,7 @@ def validate_docx_file(func):
         except Exception as e:
             print(f"Ошибка при обработке файла {input_file}: {str(e)}")
             return None
-    
+
     return wrapper
 
 def validate_excel_file(func):
@@ -34,15 +87,10 @@ def validate_excel_file(func):
         if not (os.path.isfile(output_file) and output_file.lower().endswith(('.xlsx', '.xls'))):
             print(f"Ошибка: Файл {output_file} не является Excel или не существует")
             return None
-        
-        try:
-            with pd.ExcelFile(output_file) as xls:
-                if not xls.sheet_names:
-                    print(f"Ошибка: Файл {output_file} не содержит листов")
-                    return None
 
-        except Exception as e:
-            print(f"Ошибка: Файл {output_file} поврежден или не является Excel: {str(e)}")
+        error = check_file_structure(output_file)
+        if error:
+            print(f"Ошибка: Файл {output_file} поврежден или не является Excel: {error}")
             return None
 
         try:
@@ -50,5 +98,5 @@ def validate_excel_file(func):
         except Exception as e:
             print(f"Ошибка при обработке файла {output_file}: {str(e)}")
             return None
-    
-    return wrapper
\ No newline at end of file
+
+    return wrapper
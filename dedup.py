@@ -0,0 +1,134 @@
+import zlib
+from typing import Callable, Dict, List, Set, Tuple
+
+import numpy as np
+
+from constants import (DEDUP_BANDS, DEDUP_NUM_PERM, DEDUP_SEED,
+                       DEDUP_SHINGLE_SIZE, DEDUP_THRESHOLD)
+from utils import preprocess_latex_for_model
+
+# Хеши шинглов 32-битные, поэтому a * x + b при простом 2^31 - 1 помещается в uint64
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+_rng = np.random.RandomState(DEDUP_SEED)
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=DEDUP_NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=DEDUP_NUM_PERM).astype(np.uint64)
+
+
+def get_shingles(text: str, size: int = DEDUP_SHINGLE_SIZE) -> Set[int]:
+    """Возвращает множество хешей символьных n-грамм нормализованного текста."""
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {
+        zlib.crc32(text[i:i + size].encode('utf-8'))
+        for i in range(len(text) - size + 1)
+    }
+
+
+def minhash_signature(shingles: Set[int]) -> Tuple[int, ...]:
+    """Вычисляет MinHash-сигнатуру множества шинглов."""
+    values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    hashed = (np.outer(_PERM_A, values) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return tuple(hashed.min(axis=1).tolist())
+
+
+def estimate_similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Оценивает коэффициент Жаккара по двум MinHash-сигнатурам."""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+def collapse_whitespace(text: str) -> str:
+    """Схлопывает пробельные символы, не меняя остальной текст.
+
+    Examples:
+        >>> collapse_whitespace("  Найдите $x^2$\tпри x=3 ")
+        'Найдите $x^2$ при x=3'
+    """
+    return " ".join(str(text).split())
+
+
+def find_exact_duplicates(
+    texts: List[str],
+    normalize: Callable[[str], str] = preprocess_latex_for_model,
+) -> List[int]:
+    """Находит задачи, совпадающие после нормализации.
+
+    Args:
+        texts: Тексты задач
+        normalize: Функция нормализации текста
+
+    Returns:
+        Список, где для каждой задачи указан индекс первой задачи с таким же текстом
+
+    Examples:
+        >>> find_exact_duplicates(["2 + 2", "3 + 3", "2  +  2"])
+        [0, 1, 0]
+    """
+    first_seen: Dict[str, int] = {}
+    return [first_seen.setdefault(normalize(text), idx) for idx, text in enumerate(texts)]
+
+
+def cluster_near_duplicates(
+    texts: List[str],
+    threshold: float = DEDUP_THRESHOLD,
+    normalize: Callable[[str], str] = preprocess_latex_for_model,
+) -> List[int]:
+    """Кластеризует почти одинаковые задачи с помощью MinHash/LSH.
+
+    Сначала объединяются точные дубликаты, затем для уникальных текстов
+    строятся MinHash-сигнатуры. Задача сравнивается только с представителями
+    кластеров, у которых совпадает хотя бы одна полоса (band) сигнатуры,
+    и присоединяется к самому похожему из них, если оценка коэффициента
+    Жаккара не меньше threshold. Иначе задача становится представителем
+    нового кластера. Так каждая задача кластера похожа на его представителя
+    не меньше чем на threshold, и цепочки A~B~C не объединяют далекие задачи.
+
+    Args:
+        texts: Тексты задач
+        threshold: Минимальная оценка сходства с представителем кластера
+        normalize: Функция нормализации текста
+
+    Returns:
+        Список, где для каждой задачи указан индекс представителя ее кластера
+    """
+    exact = find_exact_duplicates(texts, normalize)
+    representatives: List[int] = list(exact)
+
+    rows = DEDUP_NUM_PERM // DEDUP_BANDS
+    signatures: Dict[int, Tuple[int, ...]] = {}
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    for idx, rep in enumerate(exact):
+        if idx != rep:
+            representatives[idx] = representatives[rep]
+            continue
+        normalized = normalize(texts[idx])
+        if not normalized:
+            continue
+
+        signature = minhash_signature(get_shingles(normalized))
+        keys = [(band, signature[band * rows:(band + 1) * rows]) for band in range(DEDUP_BANDS)]
+        candidates = {leader for key in keys for leader in buckets.get(key, [])}
+        best_leader, best_similarity = None, 0.0
+        for leader in sorted(candidates):
+            similarity = estimate_similarity(signature, signatures[leader])
+            if similarity >= threshold and similarity > best_similarity:
+                best_leader, best_similarity = leader, similarity
+                if similarity == 1.0:
+                    break
+
+        if best_leader is not None:
+            representatives[idx] = best_leader
+            continue
+
+        signatures[idx] = signature
+        for key in keys:
+            buckets.setdefault(key, []).append(idx)
+
+    return representatives
+
+
+def dedup_ratio(representatives: List[int]) -> float:
+    """Доля задач, которые не требуют отдельной обработки."""
+    if not representatives:
+        return 0.0
+    return 1 - len(set(representatives)) / len(representatives)
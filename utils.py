@@ -1,10 +1,14 @@
+import json
 import os
 import re
+import tempfile
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, TextIO
 
 import pandas as pd
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
 
-from constants import TASK_SHEET_NAME, TOC_SHEET_NAME
+from constants import CHUNK_JOURNAL_SUFFIX, TASK_SHEET_NAME, TOC_SHEET_NAME
 
 
 def save_to_excel(data, output_file:str, sheet_name:str):
@@ -21,6 +25,175 @@ def save_to_excel(data, output_file:str, sheet_name:str):
     return df
 
 
+def rewrite_sheet_in_chunks(
+    output_file: str,
+    sheet_name: str,
+    process_chunk: Callable[[pd.DataFrame], pd.DataFrame],
+    chunk_size: int,
+    journal_tag: str,
+) -> int:
+    """Потоково перезаписывает лист Excel, обрабатывая его частями.
+
+    Книга читается в режиме read_only, поэтому в памяти одновременно
+    находится не более chunk_size строк листа. Каждая обработанная часть
+    сразу дописывается в журнал <файл>.<лист>.<journal_tag><CHUNK_JOURNAL_SUFFIX>
+    и сбрасывается на диск. Если обработка прервалась, повторный вызов той же
+    операции продолжает работу с первой незаписанной строки; журнал, созданный
+    другой операцией или для другой версии файла, отбрасывается.
+
+    Когда все части обработаны, новая книга собирается в режиме write_only
+    и заменяет исходный файл, после чего журнал удаляется. Остальные листы
+    при этом копируются только как значения: стили, ширины колонок,
+    объединенные ячейки и гиперссылки не сохраняются. Значения, которые
+    нельзя записать в JSON (например, даты), сохраняются строками.
+
+    Args:
+        output_file: Путь к Excel-файлу
+        sheet_name: Имя обрабатываемого листа
+        process_chunk: Функция, получающая часть листа в виде DataFrame
+                       и возвращающая обработанную часть
+        chunk_size: Количество строк в одной части
+        journal_tag: Имя операции, например "topics" или "ai_solution";
+                     журнал продолжается только той же операцией
+
+    Returns:
+        Количество обработанных строк листа
+    """
+    journal_file = f"{output_file}.{sheet_name}.{journal_tag}{CHUNK_JOURNAL_SUFFIX}"
+    stat = os.stat(output_file)
+    source_version = {"tag": journal_tag, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    processed = _read_chunk_journal(journal_file, source_version)
+    if processed:
+        print(f"Продолжение обработки листа '{sheet_name}' со строки {processed + 1}")
+
+    source = load_workbook(output_file, read_only=True)
+    fd, tmp_file = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(output_file)))
+    os.close(fd)
+    try:
+        if sheet_name not in source.sheetnames:
+            raise ValueError(f"Лист '{sheet_name}' не найден в файле {output_file}")
+
+        rows = source[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is not None:
+            with open(journal_file, 'a', encoding='utf-8') as journal:
+                if journal.tell() == 0:
+                    _append_journal_line(journal, source_version)
+                for chunk in _iter_row_chunks(islice(rows, processed, None), chunk_size):
+                    result = process_chunk(pd.DataFrame(chunk, columns=header)).astype(object)
+                    result = result.where(result.notna(), None)
+                    _append_journal_line(journal, {
+                        "columns": [str(column) for column in result.columns],
+                        "rows": result.values.tolist(),
+                    })
+                    processed += len(chunk)
+                    print(f"Обработано: {processed} строк листа '{sheet_name}'")
+
+        target = Workbook(write_only=True)
+        for name in source.sheetnames:
+            target_sheet = target.create_sheet(name)
+            if name != sheet_name:
+                for row in source[name].iter_rows(values_only=True):
+                    target_sheet.append(row)
+            elif header is not None:
+                _write_journal_rows(journal_file, target_sheet, list(header))
+
+        target.save(tmp_file)
+        source.close()
+        os.replace(tmp_file, output_file)
+        if os.path.exists(journal_file):
+            os.remove(journal_file)
+    finally:
+        source.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return processed
+
+
+def _append_journal_line(journal: TextIO, record: dict) -> None:
+    """Дописывает запись в журнал частей и сбрасывает ее на диск."""
+    journal.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def _read_chunk_journal(journal_file: str, source_version: dict) -> int:
+    """Возвращает число строк, уже записанных в журнал частей.
+
+    Недописанная последняя запись отрезается. Журнал другой операции
+    или для другой версии исходного файла удаляется.
+    """
+    if not os.path.exists(journal_file):
+        return 0
+
+    done = 0
+    with open(journal_file, 'r+', encoding='utf-8') as journal:
+        first_line = journal.readline()
+        try:
+            is_current = first_line.endswith('\n') and json.loads(first_line) == source_version
+        except ValueError:
+            is_current = False
+        if not is_current:
+            journal.close()
+            os.remove(journal_file)
+            return 0
+
+        good_offset = journal.tell()
+        for line in iter(journal.readline, ''):
+            if not line.endswith('\n'):
+                break
+            try:
+                done += len(json.loads(line)["rows"])
+            except (ValueError, KeyError):
+                break
+            good_offset = journal.tell()
+        journal.truncate(good_offset)
+    return done
+
+
+def _write_journal_rows(journal_file: str, target_sheet, header: List[str]) -> None:
+    """Переносит обработанные части из журнала в лист книги.
+
+    Заголовок листа - объединение колонок всех частей в порядке появления,
+    поэтому колонка, которая есть только в части записей, не теряется.
+    """
+    columns: List[str] = []
+    with open(journal_file, 'r', encoding='utf-8') as journal:
+        journal.readline()
+        for line in journal:
+            for column in json.loads(line)["columns"]:
+                if column not in columns:
+                    columns.append(column)
+
+    if not columns:
+        target_sheet.append(header)
+        return
+
+    target_sheet.append(columns)
+    with open(journal_file, 'r', encoding='utf-8') as journal:
+        journal.readline()
+        for line in journal:
+            record = json.loads(line)
+            positions = {column: pos for pos, column in enumerate(record["columns"])}
+            for row in record["rows"]:
+                target_sheet.append([
+                    row[positions[column]] if column in positions else None
+                    for column in columns
+                ])
+
+
+def _iter_row_chunks(rows: Iterable[tuple], chunk_size: int) -> Iterator[List[tuple]]:
+    """Группирует строки листа в списки длиной не более chunk_size."""
+    chunk: List[tuple] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def reorder_sheets(output_file):
     """Переносит лист <TASK_SHEET_NAME> на первую позицию"""
     wb = load_workbook(output_file)
@@ -118,4 +291,30 @@ def is_subtask(task_id: str, main_num: str) -> bool:
     """
     main_num = str(main_num).rstrip('.')
     pattern = rf'^{main_num}\.\d+$|^{main_num}\.[а-яё]$'
-    return bool(re.fullmatch(pattern, str(task_id)))
\ No newline at end of file
+    return bool(re.fullmatch(pattern, str(task_id)))
+
+
+def preprocess_latex_for_model(text: str) -> str:
+    if not isinstance(text, str):
+        return ""
+
+    def process_formula(match):
+        formula = match.group(1)
+        substitutions = {
+            r"\\frac": ' / ', r"\\cdot": ' · ', r"\\times": ' × ',
+            r"\\div": ' ÷ ', r"\\leq": ' ≤ ', r"\\geq": ' ≥ ',
+            r"\\neq": ' ≠ ', r"\\approx": ' ≈ ', r"\\rightarrow": ' → ',
+            r"\\leftarrow": ' ← ', r"\\leftrightarrow": ' ↔ ',
+            r"\\partial": ' ∂ ', r"\\infty": ' ∞ ', r"\\pi": ' π ',
+            r"\\int": ' <INT> ', r"\\sum": ' <SUM> ', r"\\lim": ' <LIM> ',
+            r"\\sqrt": ' <SQRT> ', r"[{}^_\\]": ' ', r"\s+": ' '
+        }
+        for pattern, replacement in substitutions.items():
+            formula = re.sub(pattern, replacement, formula)
+        return f" {formula.strip()} "
+
+    processed_text = text
+    patterns = [r"\\\((.*?)\\\)", r"\\\[(.*?)\\\]", r"\$(.*?)\$"]
+    for pat in patterns:
+        processed_text = re.sub(pat, process_formula, processed_text)
+    return re.sub(r"\s+", ' ', processed_text).strip().lower()